@@ -1,5 +1,9 @@
 # Supported file extensions, case-insensitive
 IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.heic', '.heif', '.gif', '.tiff', '.tif')
+# Multi-frame inputs with these extensions are encoded by ffmpeg instead of ImageMagick
+ANIMATED_IMAGE_EXTENSIONS = ('.gif',)
+# JPEGs above the max resolution are decoded at a reduced DCT scale before resizing
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
 VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.mpg', '.mpeg', '.m4v', '.webm', '.ts')
 
 # Default FFmpeg arguments for video conversion
@@ -15,4 +19,31 @@ DEFAULT_VIDEO_SPEED_PRESET = 6
 
 # Live Photo CRF offset - when processing .MOV files that are part of Live Photos (paired with .HEIC files)
 # The CRF value will be increased by this offset to reduce quality and file size for Live Photo videos
-LIVE_PHOTO_CRF_OFFSET = 15
\ No newline at end of file
+LIVE_PHOTO_CRF_OFFSET = 15
+
+# Rough cost model used by --plan to size jobs before running them.
+# These are placeholder guesses, not measurements, for the default speed presets and quality;
+# tune them for your hardware, or run --plan with --plan-sample to rescale them from real encodes.
+PLAN_IMAGE_CPU_SECONDS_PER_MEGAPIXEL = 0.6
+PLAN_IMAGE_OUTPUT_BYTES_PER_MEGAPIXEL = 120_000
+PLAN_VIDEO_CPU_SECONDS_PER_MEGAPIXEL_FRAME = 0.15
+PLAN_VIDEO_OUTPUT_BITS_PER_PIXEL_FRAME = 0.02
+PLAN_AUDIO_BITRATE = 96_000
+
+# Relative encode cost of each speed preset against the default one (1.0), used to scale
+# the per-megapixel CPU costs above. Also rough placeholders; use --plan-sample to calibrate.
+PLAN_IMAGE_SPEED_COST = {0: 12.0, 1: 6.0, 2: 3.5, 3: 1.8, 4: 1.0, 5: 0.7, 6: 0.45, 7: 0.35, 8: 0.3, 9: 0.25, 10: 0.2}
+PLAN_VIDEO_SPEED_COST = {0: 40.0, 1: 20.0, 2: 9.0, 3: 4.5, 4: 2.6, 5: 1.6, 6: 1.0, 7: 0.7,
+                         8: 0.45, 9: 0.3, 10: 0.22, 11: 0.16, 12: 0.12, 13: 0.1}
+# Output size roughly doubles for every this many CRF steps down / quality steps up
+# from the defaults the byte costs above assume (CRF 45, quality 75).
+PLAN_VIDEO_CRF_DOUBLING = 6
+PLAN_IMAGE_QUALITY_DOUBLING = 12
+PLAN_REFERENCE_CRF = 45
+PLAN_REFERENCE_QUALITY = 75
+
+# Read-ahead staging (--scratch-dir): sources are copied to local scratch with large
+# sequential reads so ffmpeg, magick and exiftool never touch slow network storage.
+STAGING_CHUNK_SIZE = 16 * 1024 * 1024
+DEFAULT_STAGE_BUDGET_GB = 20
+DEFAULT_STAGE_AHEAD = 8
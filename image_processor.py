@@ -1,66 +1,166 @@
 import logging
+import threading
 from math import sqrt, floor
 from pathlib import Path
 from utils import run_command
 from metadata_handler import copy_metadata
+from video_processor import convert_animated_image
+from config import ANIMATED_IMAGE_EXTENSIONS, DEFAULT_VIDEO_ARGS, DEFAULT_VIDEO_SPEED_PRESET, JPEG_EXTENSIONS
+import metrics
 
-try:
-    from apple_hdr_avif_utils import convert_apple_hdr_to_avif, has_gain_map
-except ImportError:
-    logging.warning("apple_hdr_avif_utils import error. Apple HDR conversion will be disabled. Please ensure all dependencies of hdr_conversion are installed.")
-    def convert_apple_hdr_to_avif(*args, **kwargs):
-        return False
-    def has_gain_map(*args, **kwargs):
-        return False
+_apple_hdr_lock = threading.Lock()
+_apple_hdr_funcs = None
+
+
+def _load_apple_hdr():
+    """
+    Imports the Apple HDR helpers on first use.
+    They pull in numpy, cv2, PIL, pillow_heif and hdr_conversion, so they are only
+    loaded when --keep-apple-hdr actually meets a HEIC file.
+    """
+    global _apple_hdr_funcs
+    with _apple_hdr_lock:
+        if _apple_hdr_funcs is None:
+            try:
+                from apple_hdr_avif_utils import convert_apple_hdr_to_avif, has_gain_map
+                _apple_hdr_funcs = (convert_apple_hdr_to_avif, has_gain_map)
+            except ImportError:
+                logging.warning("apple_hdr_avif_utils import error. Apple HDR conversion will be disabled. Please ensure all dependencies of hdr_conversion are installed.")
+                _apple_hdr_funcs = (lambda *args, **kwargs: False, lambda *args, **kwargs: False)
+        return _apple_hdr_funcs
 
-def process_image(filepath: Path, source_dir: Path, target_dir: Path, quality: int, max_res: int, delete_original: bool, speed_preset: int, keep_apple_hdr: bool = False):
-    """Converts a single image to AVIF with a fallback to WebP."""
+
+def get_image_target_paths(filepath: Path, source_dir: Path, target_dir: Path) -> tuple[Path, Path]:
+    """Returns the (AVIF, WebP fallback) output paths for an image."""
     relative_path = filepath.relative_to(source_dir)
-    target_path_avif = (target_dir / relative_path).with_suffix('.avif')
-    target_path_webp = (target_dir / relative_path).with_suffix('.webp')
+    return (target_dir / relative_path).with_suffix('.avif'), (target_dir / relative_path).with_suffix('.webp')
 
-    # Skip if target file already exists and has non-zero size
-    if (target_path_avif.exists() and target_path_avif.stat().st_size > 0) or \
-       (target_path_webp.exists() and target_path_webp.stat().st_size > 0):
-        logging.info(f"Skipping already converted file: {filepath.name}")
-        return
 
-    target_path_avif.parent.mkdir(parents=True, exist_ok=True)
+def is_image_converted(filepath: Path, source_dir: Path, target_dir: Path) -> bool:
+    """Checks whether a non-empty AVIF or WebP output already exists for an image."""
+    return any(p.exists() and p.stat().st_size > 0
+               for p in get_image_target_paths(filepath, source_dir, target_dir))
 
-    # Get dimensions using ImageMagick's identify
+
+def get_image_info(filepath: Path) -> dict:
+    """
+    Gets image width, height and frame count using ImageMagick's identify, and for
+    animation candidates whether the first frame has any transparent pixels.
+    Width and height come from the first frame; all are 0 on failure.
+    """
     try:
-        cmd_identify = ['magick', 'identify', '-format', '%wx%h', str(filepath)]
+        # -ping reads headers only; one line is printed per frame
+        cmd_identify = ['magick', 'identify', '-ping', '-format', '%wx%h\n', str(filepath)]
         identify_result = run_command(cmd_identify)
-        if not identify_result or not identify_result.stdout:
+        if not identify_result or not identify_result.stdout.strip():
             raise ValueError(
                 f"Could not get dimensions for {filepath} using identify")
 
-        # The output format '%wx%h' is identical to the old ffprobe command,
-        # so the parsing logic remains the same.
-        width, height = map(int, identify_result.stdout.strip().split('x'))
-        resolution = width * height
+        frames = identify_result.stdout.strip().splitlines()
+        width, height = map(int, frames[0].split('x'))
     except ValueError:
         logging.error(f"Error getting image dimensions for {filepath}.")
-        width, height, resolution = 0, 0, 0
-
-    # Calculate resize filter if necessary
-    resize_filter = []
-    if resolution > max_res:
-        scale_factor = sqrt(max_res / resolution)
-        target_width = floor(width * scale_factor / 2) * 2
-        target_height = floor(height * scale_factor / 2) * 2
+        return {'width': 0, 'height': 0, 'frames': 0, 'transparent': False}
+
+    transparent = False
+    if len(frames) > 1 and filepath.suffix.lower() in ANIMATED_IMAGE_EXTENSIONS:
+        # Frame-optimized GIFs flag the transparent index on almost every later frame even
+        # though the composed picture is opaque, so per-frame alpha is useless here.
+        # Later frames are drawn over the first one, so if it is opaque the animation
+        # normally is too. Only the first frame is decoded.
+        cmd_opaque = ['magick', 'identify', '-format', '%[opaque]', f'{filepath}[0]']
+        opaque_result = run_command(cmd_opaque)
+        transparent = not opaque_result or opaque_result.stdout.strip().lower() != 'true'
+    return {'width': width, 'height': height, 'frames': len(frames), 'transparent': transparent}
+
+
+def is_animated(filepath: Path, image_info: dict) -> bool:
+    """
+    Checks whether an image should go through the ffmpeg animation path.
+    Transparent animations stay on magick, since the AV1 path drops alpha.
+    """
+    return (filepath.suffix.lower() in ANIMATED_IMAGE_EXTENSIONS
+            and image_info['frames'] > 1 and not image_info['transparent'])
+
+
+def get_resize_target(width: int, height: int, max_res: int) -> tuple[int, int] | None:
+    """Returns even dimensions that fit within max_res pixels, or None if no resize is needed."""
+    resolution = width * height
+    if resolution <= max_res:
+        return None
+    scale_factor = sqrt(max_res / resolution)
+    return floor(width * scale_factor / 2) * 2, floor(height * scale_factor / 2) * 2
+
+
+def build_magick_command(filepath: Path, output_path: Path, resize_target: tuple[int, int] | None, quality: int, speed_preset: int) -> list[str]:
+    """Builds the ImageMagick command that converts an image, resizing it to resize_target if given."""
+    decode_hint, resize_filter = [], []
+    if resize_target:
+        target_width, target_height = resize_target
         resize_filter = ['-resize', f'{target_width}x{target_height}']
-    else:
-        target_width, target_height = None, None
+        # Shrink-on-load: libjpeg decodes oversized JPEGs at the smallest M/8 DCT scale
+        # that is still at least the target size, then -resize brings it to the exact size
+        if filepath.suffix.lower() in JPEG_EXTENSIONS:
+            decode_hint = ['-define', f'jpeg:size={target_width}x{target_height}']
+
+    return [
+        'magick', *decode_hint, str(filepath),
+        *resize_filter,
+        '-quality', str(quality),
+        '-define', f'heic:speed={speed_preset}', # Speed preset for AVIF/HEIC
+        '-depth', '10',           # 10-bit for better color
+        str(output_path)
+    ]
+
+
+def process_image(filepath: Path, source_dir: Path, target_dir: Path, quality: int, max_res: int, delete_original: bool, speed_preset: int, keep_apple_hdr: bool = False, video_args: str = DEFAULT_VIDEO_ARGS, max_framerate: int = 0, video_speed: int = DEFAULT_VIDEO_SPEED_PRESET, max_video_res: int = 0) -> bool:
+    """
+    Converts a single image to AVIF with a fallback to WebP.
+    Animated GIFs are encoded to animated AVIF with ffmpeg using the video settings
+    (video_args, video_speed, max_video_res, max_framerate) rather than the image ones.
+    Returns True only if a new output was written.
+    """
+    target_path_avif, target_path_webp = get_image_target_paths(filepath, source_dir, target_dir)
+
+    # Skip if target file already exists and has non-zero size
+    if is_image_converted(filepath, source_dir, target_dir):
+        logging.info(f"Skipping already converted file: {filepath.name}")
+        metrics.record_skipped('image')
+        return False
+
+    target_path_avif.parent.mkdir(parents=True, exist_ok=True)
+    source_bytes = filepath.stat().st_size
+
+    image_info = get_image_info(filepath)
+    width, height = image_info['width'], image_info['height']
+
+    # Calculate resize target if necessary
+    resize_target = get_resize_target(width, height, max_res)
+    target_width, target_height = resize_target or (None, None)
 
     success = False
+    hdr_attempted = False
+
+    if is_animated(filepath, image_info):
+        logging.debug(f"{filepath.name} has {image_info['frames']} frames, encoding with ffmpeg")
+        success = convert_animated_image(filepath, target_path_avif, ffmpeg_args=video_args, max_res=max_video_res,
+                                         max_framerate=max_framerate, speed_preset=video_speed)
+        if not success:
+            logging.warning(f"ffmpeg animation encode failed for {filepath.name}. Falling back to ImageMagick.")
+            # Only video encoder options from --video-args reach this encode; a failure here means
+            # the encoder or ffmpeg build (AVIF muxer needs ffmpeg 6.0+) rejected the animation
+            metrics.record_fallback('animation_to_magick')
+    elif image_info['transparent']:
+        logging.debug(f"{filepath.name} is an animation with transparency, keeping it on ImageMagick")
 
     # Try Apple HDR conversion if enabled and file has gain map
     if keep_apple_hdr and filepath.suffix.lower() in ['.heic', '.heif']:
         try:
+            convert_apple_hdr_to_avif, has_gain_map = _load_apple_hdr()
             logging.debug(f"Checking for Apple HDR gain map in {filepath.name}")
             if has_gain_map(str(filepath)):
                 logging.debug(f"Apple HDR gain map found in {filepath.name}, attempting HDR conversion")
+                hdr_attempted = True
                 
                 # Attempt Apple HDR to AVIF conversion
                 success = convert_apple_hdr_to_avif(
@@ -74,17 +174,13 @@ def process_image(filepath: Path, source_dir: Path, target_dir: Path, quality: i
         except Exception as e:
             logging.warning(f"Error during Apple HDR conversion for {filepath.name}: {e}")
             success = False
+        if hdr_attempted and not success:
+            logging.warning(f"Apple HDR conversion failed for {filepath.name}. Falling back to SDR.")
+            metrics.record_fallback('hdr_to_sdr')
 
     if not success:
         # Build conversion command (use ImageMagick for broad compatibility)
-        cmd = [
-            'magick', str(filepath),
-            *resize_filter,
-            '-quality', str(quality),
-            '-define', f'heic:speed={speed_preset}', # Speed preset for AVIF/HEIC
-            '-depth', '10',           # 10-bit for better color
-            str(target_path_avif)
-        ]
+        cmd = build_magick_command(filepath, target_path_avif, resize_target, quality, speed_preset)
 
         # Execute conversion
         success = run_command(cmd)
@@ -92,16 +188,27 @@ def process_image(filepath: Path, source_dir: Path, target_dir: Path, quality: i
     if success:
         logging.debug(f"Successfully converted {filepath.name} to AVIF")
         copy_metadata(filepath, target_path_avif)
+        metrics.record_converted('image', source_bytes, target_path_avif)
         if delete_original:
             filepath.unlink()
+        return True
     else:
         # Fallback to WebP if AVIF conversion fails
         logging.warning(f"AVIF conversion failed for {filepath.name}. Falling back to WebP.")
+        metrics.record_fallback('avif_to_webp')
+        if target_path_avif.exists(): # Clean up failed attempt so it is not mistaken for a finished file
+            target_path_avif.unlink()
         cmd[-1] = str(target_path_webp) # Change output path
         if run_command(cmd):
             logging.debug(f"Successfully converted {filepath.name} to WebP")
             copy_metadata(filepath, target_path_webp)
+            metrics.record_converted('image', source_bytes, target_path_webp)
             if delete_original:
                 filepath.unlink()
+            return True
         else:
-            logging.error(f"WebP fallback also failed for {filepath.name}")
\ No newline at end of file
+            logging.error(f"WebP fallback also failed for {filepath.name}")
+            metrics.record_failed('image', filepath, 'avif and webp encodes failed')
+            if target_path_webp.exists(): # Clean up failed attempt
+                target_path_webp.unlink()
+            return False
\ No newline at end of file
@@ -1,6 +1,8 @@
 import argparse
 import utils
 import processor
+import planner
+import metrics
 import config
 import logging
 
@@ -38,19 +40,57 @@ def main():
     parser.add_argument("--skip-existing", action="store_true", default=True, help="Skip files that already exist in the target directory.")
     parser.add_argument("--keep-apple-hdr", action="store_true", help="Preserve Apple HDR metadata when converting HEIC files with gain maps.")
     
+    parser.add_argument("--scratch-dir", type=str, default=None, help="Local scratch directory. If set, sources are prefetched here and outputs are written here before being moved to the target directory.")
+    parser.add_argument("--stage-budget", type=float, default=config.DEFAULT_STAGE_BUDGET_GB, help="Maximum GB of source files staged in the scratch directory at once.")
+    parser.add_argument("--stage-ahead", type=int, default=config.DEFAULT_STAGE_AHEAD, help="Number of queued files to prefetch ahead of the workers.")
+
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus-style metrics on this local port during the run. Disabled if not set.")
+    parser.add_argument("--metrics-host", type=str, default="127.0.0.1", help="Address to bind the metrics endpoint to.")
+    parser.add_argument("--report-file", type=str, default="conversion_report.json", help="Path to the JSON run report written at the end of each run.")
+    parser.add_argument("--plan", action="store_true", help="Probe files and print what would be converted or skipped, with estimated CPU-hours and output size, without encoding anything.")
+    parser.add_argument("--plan-sample", type=int, default=0, help="With --plan, really encode up to this many files per media type into a temporary directory and rescale the estimates from them.")
+
     parser.add_argument("--log-file", type=str, default="conversion.log", help="Path to the log file.")
 
     args = parser.parse_args()
+    if args.stage_ahead < 1:
+        parser.error("--stage-ahead must be at least 1.")
+    if args.stage_budget < 0:
+        parser.error("--stage-budget must not be negative.")
+    if args.plan_sample < 0:
+        parser.error("--plan-sample must not be negative.")
 
     # Setup
     utils.setup_logging(args.log_file)
-    utils.check_dependencies()
+    # Planning only probes files, so it needs just the probing tools unless it runs sample encodes
+    utils.check_dependencies(['ffprobe', 'magick'] if args.plan and not args.plan_sample else None)
     
     # Parse resolution strings into integers
     max_image_res = parse_resolution_string(args.max_image_resolution)
     max_video_res = parse_resolution_string(args.max_video_resolution)
 
+    if args.plan:
+        planner.plan_media(
+            source_dir=args.source_dir,
+            target_dir=args.target_dir,
+            quality=args.quality,
+            max_image_res=max_image_res,
+            max_video_res=max_video_res,
+            max_framerate=args.max_framerate,
+            video_args=args.video_args,
+            max_workers=args.max_workers,
+            image_speed=args.image_speed,
+            video_speed=args.video_speed,
+            keep_apple_hdr=args.keep_apple_hdr,
+            sample_files=args.plan_sample
+        )
+        return
+
+    if args.metrics_port is not None:
+        metrics.start_server(args.metrics_host, args.metrics_port)
+
     # Start processing
+    interrupted = False
     try:
         processor.process_media(
             source_dir=args.source_dir,
@@ -65,10 +105,17 @@ def main():
             skip_existing=args.skip_existing,
             image_speed=args.image_speed,
             video_speed=args.video_speed,
-            keep_apple_hdr=args.keep_apple_hdr
+            keep_apple_hdr=args.keep_apple_hdr,
+            scratch_dir=args.scratch_dir,
+            stage_budget_bytes=int(args.stage_budget * 1024**3),
+            stage_ahead=args.stage_ahead
         )
     except KeyboardInterrupt:
+        interrupted = True
         utils.logging.info("\nProcess interrupted by user. Exiting.")
+    finally:
+        metrics.write_report(args.report_file, interrupted=interrupted)
+    if interrupted:
         exit(0)
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+import json
+import logging
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Metric name -> (type, help text). Every metric is exported with this prefix.
+METRIC_PREFIX = 'mediaconv_'
+METRICS = {
+    'files_total': ('counter', 'Files finished by the pipeline, by media type and status.'),
+    'bytes_in_total': ('counter', 'Source bytes of successfully converted files.'),
+    'bytes_out_total': ('counter', 'Output bytes of successfully converted files.'),
+    'fallbacks_total': ('counter', 'Conversions that fell back to a degraded path (avif_to_webp, hdr_to_sdr, animation_to_magick).'),
+    'video_frames_encoded_total': ('counter', 'Video frames encoded by ffmpeg.'),
+    'video_encode_seconds_total': ('counter', 'Wall-clock seconds spent in ffmpeg encodes.'),
+    'queued_files': ('gauge', 'Files submitted to the worker pool but not yet started.'),
+    'active_workers': ('gauge', 'Workers currently processing a file.'),
+    'staged_bytes': ('gauge', 'Bytes of source files currently staged in local scratch.'),
+    'compression_ratio': ('gauge', 'Output bytes divided by input bytes for converted files.'),
+    'video_encode_fps': ('gauge', 'Average encode speed in frames per second across all video encodes.'),
+    'last_success_timestamp_seconds': ('gauge', 'Unix time of the most recent successful conversion.'),
+}
+
+_lock = threading.Lock()
+_values = {}
+_failed_files = []
+_started_at = time.time()
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Increments a counter or gauge."""
+    with _lock:
+        key = _key(name, labels)
+        _values[key] = _values.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    """Sets a gauge to an absolute value."""
+    with _lock:
+        _values[_key(name, labels)] = value
+
+
+def _get(name: str, **labels) -> float:
+    return _values.get(_key(name, labels), 0)
+
+
+def record_converted(media_type: str, source_bytes: int, target_path: Path):
+    """Records a successful conversion and its input/output sizes."""
+    target_bytes = target_path.stat().st_size if target_path.exists() else 0
+    inc('files_total', type=media_type, status='converted')
+    inc('bytes_in_total', source_bytes, type=media_type)
+    inc('bytes_out_total', target_bytes, type=media_type)
+    set_gauge('last_success_timestamp_seconds', time.time())
+
+
+def record_skipped(media_type: str):
+    """Records a file that was skipped because its output already exists."""
+    inc('files_total', type=media_type, status='skipped')
+
+
+def record_failed(media_type: str, filepath: Path, reason: str):
+    """Records a failed conversion."""
+    inc('files_total', type=media_type, status='failed')
+    with _lock:
+        _failed_files.append({'path': str(filepath), 'type': media_type, 'reason': reason})
+
+
+def record_fallback(kind: str):
+    """Records a fallback such as 'avif_to_webp' or 'hdr_to_sdr'."""
+    inc('fallbacks_total', kind=kind)
+
+
+def record_video_encode(frames: float, seconds: float):
+    """Records the frame count and duration of a finished ffmpeg encode."""
+    inc('video_frames_encoded_total', frames)
+    inc('video_encode_seconds_total', seconds)
+
+
+def _derived_values() -> dict:
+    """Computes ratio metrics from the raw counters. Caller must hold the lock."""
+    derived = {}
+    media_types = {dict(labels).get('type') for name, labels in _values if name == 'bytes_in_total'}
+    for media_type in media_types:
+        bytes_in = _get('bytes_in_total', type=media_type)
+        if bytes_in:
+            derived[_key('compression_ratio', {'type': media_type})] = _get('bytes_out_total', type=media_type) / bytes_in
+    encode_seconds = _get('video_encode_seconds_total')
+    if encode_seconds:
+        derived[_key('video_encode_fps', {})] = _get('video_frames_encoded_total') / encode_seconds
+    return derived
+
+
+def render_prometheus() -> str:
+    """Renders all metrics in the Prometheus text exposition format."""
+    with _lock:
+        values = {**_values, **_derived_values()}
+
+    lines = []
+    for name, (metric_type, help_text) in METRICS.items():
+        samples = sorted((labels, value) for (n, labels), value in values.items() if n == name)
+        if not samples:
+            continue
+        lines.append(f"# HELP {METRIC_PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}{name} {metric_type}")
+        for labels, value in samples:
+            label_str = ','.join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{METRIC_PREFIX}{name}{{{label_str}}} {value:.15g}" if label_str
+                         else f"{METRIC_PREFIX}{name} {value:.15g}")
+    return '\n'.join(lines) + '\n'
+
+
+def start_server(host: str, port: int):
+    """Serves /metrics from a daemon thread and returns the server."""
+    # Imported here so runs without --metrics-port do not pay for loading http.server
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') not in ('', '/metrics'):
+                self.send_error(404)
+                return
+            body = render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Keep scrapes out of the conversion log
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def write_report(report_file: str, interrupted: bool = False):
+    """Writes a machine-readable JSON summary of the run."""
+    finished_at = time.time()
+    with _lock:
+        derived = _derived_values()
+        report = {
+            'started_at': datetime.fromtimestamp(_started_at).isoformat(),
+            'finished_at': datetime.fromtimestamp(finished_at).isoformat(),
+            'duration_seconds': round(finished_at - _started_at, 3),
+            'interrupted': interrupted,
+            'types': {},
+            'fallbacks': {dict(labels)['kind']: value
+                          for (name, labels), value in _values.items() if name == 'fallbacks_total'},
+            'video_encode': {
+                'frames': _get('video_frames_encoded_total'),
+                'seconds': _get('video_encode_seconds_total'),
+                'fps': derived.get(_key('video_encode_fps', {}), 0),
+            },
+            'failed_files': list(_failed_files),
+        }
+        for (name, labels), value in _values.items():
+            labels = dict(labels)
+            if 'type' not in labels:
+                continue
+            stats = report['types'].setdefault(labels['type'], {
+                'converted': 0, 'skipped': 0, 'failed': 0, 'bytes_in': 0, 'bytes_out': 0, 'compression_ratio': None})
+            if name == 'files_total':
+                stats[labels['status']] = value
+            elif name == 'bytes_in_total':
+                stats['bytes_in'] = value
+            elif name == 'bytes_out_total':
+                stats['bytes_out'] = value
+        for media_type, stats in report['types'].items():
+            stats['compression_ratio'] = derived.get(_key('compression_ratio', {'type': media_type}))
+
+    try:
+        Path(report_file).write_text(json.dumps(report, indent=2), encoding='utf-8')
+        logging.info(f"Run report written to {report_file}")
+    except OSError as e:
+        logging.error(f"Failed to write run report to {report_file}: {e}")
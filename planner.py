@@ -0,0 +1,204 @@
+import os
+import re
+import logging
+import tempfile
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from tqdm import tqdm
+from config import (
+    PLAN_IMAGE_CPU_SECONDS_PER_MEGAPIXEL, PLAN_IMAGE_OUTPUT_BYTES_PER_MEGAPIXEL,
+    PLAN_VIDEO_CPU_SECONDS_PER_MEGAPIXEL_FRAME, PLAN_VIDEO_OUTPUT_BITS_PER_PIXEL_FRAME,
+    PLAN_AUDIO_BITRATE, PLAN_IMAGE_SPEED_COST, PLAN_VIDEO_SPEED_COST, PLAN_VIDEO_CRF_DOUBLING,
+    PLAN_IMAGE_QUALITY_DOUBLING, PLAN_REFERENCE_CRF, PLAN_REFERENCE_QUALITY
+)
+from utils import format_bytes
+from processor import find_media_files
+from image_processor import get_image_info, is_image_converted, is_animated, process_image
+from video_processor import get_video_info, is_video_converted, build_video_filters, process_video
+
+
+def _cost_model(quality: int, video_args: str, image_speed: int, video_speed: int) -> dict:
+    """Scales the default-settings costs in config to the chosen speed presets, quality and CRF."""
+    crf_match = re.search(r'-crf (\d+)', video_args)
+    crf = int(crf_match.group(1)) if crf_match else PLAN_REFERENCE_CRF
+    return {
+        'image_cpu_seconds_per_megapixel': PLAN_IMAGE_CPU_SECONDS_PER_MEGAPIXEL * PLAN_IMAGE_SPEED_COST.get(image_speed, 1.0),
+        'image_output_bytes_per_megapixel': PLAN_IMAGE_OUTPUT_BYTES_PER_MEGAPIXEL
+                                            * 2 ** ((quality - PLAN_REFERENCE_QUALITY) / PLAN_IMAGE_QUALITY_DOUBLING),
+        'video_cpu_seconds_per_megapixel_frame': PLAN_VIDEO_CPU_SECONDS_PER_MEGAPIXEL_FRAME * PLAN_VIDEO_SPEED_COST.get(video_speed, 1.0),
+        'video_output_bits_per_pixel_frame': PLAN_VIDEO_OUTPUT_BITS_PER_PIXEL_FRAME
+                                             * 2 ** ((PLAN_REFERENCE_CRF - crf) / PLAN_VIDEO_CRF_DOUBLING),
+    }
+
+
+def _scaled_pixels(width: int, height: int, max_res: int) -> int:
+    """Returns the output pixel count after applying the resolution cap."""
+    resolution = width * height
+    if max_res and resolution > max_res:
+        return max_res
+    return resolution
+
+
+def _plan_image(filepath: Path, source_dir: Path, target_dir: Path, max_res: int, max_video_res: int, model: dict) -> dict:
+    """Probes a single image and estimates the cost of converting it."""
+    entry = {'path': filepath, 'type': 'image', 'model': 'image', 'input_bytes': filepath.stat().st_size,
+             'cpu_seconds': 0.0, 'output_bytes': 0}
+    if is_image_converted(filepath, source_dir, target_dir):
+        entry['action'] = 'skip'
+        return entry
+
+    image_info = get_image_info(filepath)
+    if not image_info['width'] or not image_info['height']:
+        entry['action'] = 'unreadable'
+        return entry
+
+    entry['action'] = 'convert'
+    if is_animated(filepath, image_info):
+        # Encoded by ffmpeg like a video; the frame rate cap is ignored, so this is an upper bound
+        pixel_frames = _scaled_pixels(image_info['width'], image_info['height'], max_video_res) * image_info['frames']
+        entry['model'] = 'video'
+        entry['cpu_seconds'] = pixel_frames / 1e6 * model['video_cpu_seconds_per_megapixel_frame']
+        entry['output_bytes'] = int(pixel_frames * model['video_output_bits_per_pixel_frame'] / 8)
+        return entry
+
+    megapixels = _scaled_pixels(image_info['width'], image_info['height'], max_res) / 1e6
+    entry['cpu_seconds'] = megapixels * model['image_cpu_seconds_per_megapixel']
+    entry['output_bytes'] = int(megapixels * model['image_output_bytes_per_megapixel'])
+    return entry
+
+
+def _plan_video(filepath: Path, source_dir: Path, target_dir: Path, max_res: int, max_framerate: int, model: dict) -> dict:
+    """Probes a single video and estimates the cost of converting it."""
+    entry = {'path': filepath, 'type': 'video', 'model': 'video', 'input_bytes': filepath.stat().st_size,
+             'cpu_seconds': 0.0, 'output_bytes': 0}
+    if is_video_converted(filepath, source_dir, target_dir):
+        entry['action'] = 'skip'
+        return entry
+
+    info = get_video_info(filepath)
+    if not info:
+        entry['action'] = 'unreadable'
+        return entry
+
+    # Use the same rotation swap and scale/fps filters process_video would apply
+    width, height, framerate = info['width'], info['height'], info.get('framerate', 0)
+    if abs(info.get('rotation', 0)) in [90, 270]:
+        width, height = height, width
+    for video_filter in build_video_filters(filepath, width, height, framerate, max_res, max_framerate):
+        if video_filter.startswith('scale='):
+            width, height = map(int, video_filter[len('scale='):].split(':'))
+        elif video_filter.startswith('fps=fps='):
+            framerate = float(video_filter[len('fps=fps='):])
+
+    pixel_frames = width * height * framerate * info['duration']
+    entry['action'] = 'convert'
+    entry['cpu_seconds'] = pixel_frames / 1e6 * model['video_cpu_seconds_per_megapixel_frame']
+    entry['output_bytes'] = int((pixel_frames * model['video_output_bits_per_pixel_frame']
+                                 + info['duration'] * PLAN_AUDIO_BITRATE) / 8)
+    return entry
+
+
+def _calibrate(plan: list[dict], sample_files: int, source_dir: Path, image_task, video_task):
+    """
+    Encodes up to sample_files median-cost files per cost model (image, video) into a
+    temporary directory and rescales every estimate of that model by measured / estimated.
+    CPU time is the user + system time of the encoder subprocesses, so samples run one at a time.
+    """
+    for model in ('image', 'video'):
+        candidates = sorted((e for e in plan if e['action'] == 'convert' and e['model'] == model),
+                            key=lambda e: e['cpu_seconds'])
+        if not candidates:
+            continue
+        # Median-cost files are more representative than the cheapest ones, where process start-up dominates
+        start = max(0, (len(candidates) - sample_files) // 2)
+        samples = candidates[start:start + sample_files]
+
+        estimated_cpu = estimated_bytes = measured_cpu = 0
+        with tempfile.TemporaryDirectory(prefix='plan-sample-') as sample_dir:
+            for entry in samples:
+                task = image_task if entry['type'] == 'image' else video_task
+                before = os.times()
+                logging.info(f"Sample encoding {entry['path'].relative_to(source_dir)}")
+                if not task(entry['path'], target_dir=Path(sample_dir)):
+                    continue
+                after = os.times()
+                measured_cpu += (after.children_user - before.children_user) + (after.children_system - before.children_system)
+                estimated_cpu += entry['cpu_seconds']
+                estimated_bytes += entry['output_bytes']
+            # Failed encodes clean up after themselves, so only sampled outputs are left
+            measured_bytes = sum(f.stat().st_size for f in Path(sample_dir).rglob('*') if f.is_file())
+
+        if not estimated_cpu or not estimated_bytes:
+            logging.warning(f"No {model} sample encode succeeded, keeping the default {model} cost model.")
+            continue
+        cpu_scale, bytes_scale = measured_cpu / estimated_cpu, measured_bytes / estimated_bytes
+        logging.info(f"Calibrated {model} estimates from {len(samples)} sample(s): "
+                     f"CPU x{cpu_scale:.2f}, output size x{bytes_scale:.2f}")
+        for entry in plan:
+            if entry['action'] == 'convert' and entry['model'] == model:
+                entry['cpu_seconds'] *= cpu_scale
+                entry['output_bytes'] = int(entry['output_bytes'] * bytes_scale)
+
+
+def plan_media(source_dir: str, target_dir: str, quality: int, max_image_res: int, max_video_res: int, max_framerate: int, video_args: str, max_workers: int, image_speed: int, video_speed: int, keep_apple_hdr: bool = False, sample_files: int = 0) -> list[dict]:
+    """
+    Discovers and probes all media files and logs what process_media would do,
+    with estimated CPU time and output size. Nothing is written to the target.
+    With sample_files, a few files are really encoded (to a temporary directory)
+    to calibrate the estimates; otherwise nothing is encoded.
+    """
+    source_path = Path(source_dir)
+    target_path = Path(target_dir)
+
+    if not source_path.is_dir():
+        logging.error(f"Source directory not found: {source_dir}")
+        return []
+
+    image_files, video_files = find_media_files(source_path)
+    logging.info(f"Found {len(image_files)} images and {len(video_files)} videos to plan.")
+
+    model = _cost_model(quality, video_args, image_speed, video_speed)
+    plan = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        image_task = partial(_plan_image, source_dir=source_path, target_dir=target_path, max_res=max_image_res, max_video_res=max_video_res, model=model)
+        video_task = partial(_plan_video, source_dir=source_path, target_dir=target_path, max_res=max_video_res, max_framerate=max_framerate, model=model)
+
+        if image_files:
+            plan += tqdm(executor.map(image_task, image_files), total=len(image_files), desc="Probing Images")
+        if video_files:
+            plan += tqdm(executor.map(video_task, video_files), total=len(video_files), desc="Probing Videos")
+
+    if sample_files:
+        # Same settings as process_media, but never deleting the originals
+        sample_image_task = partial(process_image, source_dir=source_path, quality=quality, max_res=max_image_res,
+                                    delete_original=False, speed_preset=image_speed, keep_apple_hdr=keep_apple_hdr,
+                                    video_args=video_args, max_framerate=max_framerate, video_speed=video_speed,
+                                    max_video_res=max_video_res)
+        sample_video_task = partial(process_video, source_dir=source_path, ffmpeg_args=video_args, max_res=max_video_res,
+                                    delete_original=False, speed_preset=video_speed, max_framerate=max_framerate)
+        _calibrate(plan, sample_files, source_path, sample_image_task, sample_video_task)
+
+    for entry in plan:
+        logging.info(f"[plan] {entry['action']:<10} {entry['path'].relative_to(source_path)}"
+                     f" ({format_bytes(entry['input_bytes'])} -> ~{format_bytes(entry['output_bytes'])},"
+                     f" ~{entry['cpu_seconds'] / 60:.1f} CPU-min)")
+
+    for media_type in ('image', 'video'):
+        entries = [e for e in plan if e['type'] == media_type]
+        if not entries:
+            continue
+        counts = {action: sum(1 for e in entries if e['action'] == action)
+                  for action in ('convert', 'skip', 'unreadable')}
+        to_convert = [e for e in entries if e['action'] == 'convert']
+        logging.info(
+            f"Plan for {media_type}s: {counts['convert']} to convert, {counts['skip']} to skip, "
+            f"{counts['unreadable']} unreadable; "
+            f"{format_bytes(sum(e['input_bytes'] for e in to_convert))} in -> "
+            f"~{format_bytes(sum(e['output_bytes'] for e in to_convert))} out, "
+            f"~{sum(e['cpu_seconds'] for e in to_convert) / 3600:.2f} CPU-hours")
+
+    logging.info(
+        f"Estimated total: ~{sum(e['cpu_seconds'] for e in plan) / 3600:.2f} CPU-hours, "
+        f"~{format_bytes(sum(e['output_bytes'] for e in plan))} of output.")
+    return plan
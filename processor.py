@@ -4,10 +4,63 @@ from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from tqdm import tqdm
 from config import IMAGE_EXTENSIONS, VIDEO_EXTENSIONS
-from image_processor import process_image
-from video_processor import process_video
+from image_processor import process_image, get_image_target_paths, is_image_converted
+from video_processor import process_video, get_video_target_path, is_video_converted
+from staging import SourceStager, OutputMover
+from utils import is_live_photo_mov
+import metrics
 
-def process_media(source_dir: str, target_dir: str, quality: int, max_image_res: int, max_video_res: int, max_framerate: int, video_args: str, max_workers: int, delete_original: bool, skip_existing: bool, image_speed: int, video_speed: int, keep_apple_hdr: bool = False):
+def find_media_files(source_path: Path) -> tuple[list[Path], list[Path]]:
+    """Recursively collects image and video files under the source directory."""
+    files_to_process = [p for p in source_path.rglob('*') if p.is_file()]
+
+    image_files = [f for f in files_to_process if f.suffix.lower() in IMAGE_EXTENSIONS]
+    video_files = [f for f in files_to_process if f.suffix.lower() in VIDEO_EXTENSIONS]
+    return image_files, video_files
+
+def _tracked(task, media_type: str, filepath: Path):
+    """Runs a conversion task while keeping the queue and worker gauges up to date."""
+    metrics.inc('queued_files', -1, type=media_type)
+    metrics.inc('active_workers', 1)
+    try:
+        return task(filepath)
+    finally:
+        metrics.inc('active_workers', -1)
+
+def _staged(task, media_type: str, stager: SourceStager, mover: OutputMover, target_path: Path, delete_original: bool, filepath: Path):
+    """
+    Runs a conversion task against the locally staged copy of a file, writing to
+    local scratch and handing the outputs to the mover only if the task succeeded.
+    Unstaged files run in place.
+    """
+    output_dir = mover.output_dir
+    local_source = stager.acquire(filepath)
+    if local_source is None:
+        return task(filepath)
+
+    kwargs = {'source_dir': stager.input_dir, 'target_dir': output_dir, 'delete_original': False}
+    if media_type == 'video':
+        # The paired HEIC is not staged, so detect Live Photos on the original
+        kwargs['live_photo'] = is_live_photo_mov(filepath)
+    try:
+        success = task(local_source, **kwargs)
+    finally:
+        stager.release(filepath)
+
+    if media_type == 'image':
+        local_outputs = get_image_target_paths(local_source, stager.input_dir, output_dir)
+    else:
+        local_outputs = [get_video_target_path(local_source, stager.input_dir, output_dir)]
+    outputs = [(p, target_path / p.relative_to(output_dir)) for p in local_outputs if p.exists()]
+    if not success:
+        for local_output, _ in outputs:
+            local_output.unlink()
+        return False
+    if outputs:
+        mover.submit(outputs, filepath, media_type, delete_original)
+    return success
+
+def process_media(source_dir: str, target_dir: str, quality: int, max_image_res: int, max_video_res: int, max_framerate: int, video_args: str, max_workers: int, delete_original: bool, skip_existing: bool, image_speed: int, video_speed: int, keep_apple_hdr: bool = False, scratch_dir: str = None, stage_budget_bytes: int = 0, stage_ahead: int = 0):
     """Finds and converts all media files in the source directory."""
     source_path = Path(source_dir)
     target_path = Path(target_dir)
@@ -16,24 +69,44 @@ def process_media(source_dir: str, target_dir: str, quality: int, max_image_res:
         logging.error(f"Source directory not found: {source_dir}")
         return
 
-    files_to_process = [p for p in source_path.rglob('*') if p.is_file()]
-    
-    image_files = [f for f in files_to_process if f.suffix.lower() in IMAGE_EXTENSIONS]
-    video_files = [f for f in files_to_process if f.suffix.lower() in VIDEO_EXTENSIONS]
+    image_files, video_files = find_media_files(source_path)
 
     logging.info(f"Found {len(image_files)} images and {len(video_files)} videos to process.")
 
+    stager, mover = None, None
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         # Create partial functions with fixed arguments for mapping
-        image_task = partial(process_image, source_dir=source_path, target_dir=target_path, quality=quality, max_res=max_image_res, delete_original=delete_original, speed_preset=image_speed, keep_apple_hdr=keep_apple_hdr)
+        image_task = partial(process_image, source_dir=source_path, target_dir=target_path, quality=quality, max_res=max_image_res, delete_original=delete_original, speed_preset=image_speed, keep_apple_hdr=keep_apple_hdr, video_args=video_args, max_framerate=max_framerate, video_speed=video_speed, max_video_res=max_video_res)
         video_task = partial(process_video, source_dir=source_path, target_dir=target_path, ffmpeg_args=video_args, max_res=max_video_res, delete_original=delete_original, speed_preset=video_speed, max_framerate=max_framerate)
+
+        if scratch_dir:
+            # Stage in the same order the pool consumes files; already converted ones are skipped without reading them
+            stage_files = [f for f in image_files if not is_image_converted(f, source_path, target_path)] + \
+                          [f for f in video_files if not is_video_converted(f, source_path, target_path)]
+            stager = SourceStager(stage_files, source_path, Path(scratch_dir), stage_budget_bytes, stage_ahead)
+            mover = OutputMover(Path(scratch_dir))
+            stager.start()
+            image_task = partial(_staged, image_task, 'image', stager, mover, target_path, delete_original)
+            video_task = partial(_staged, video_task, 'video', stager, mover, target_path, delete_original)
+
+        image_task = partial(_tracked, image_task, 'image')
+        video_task = partial(_tracked, video_task, 'video')
+        metrics.set_gauge('queued_files', len(image_files), type='image')
+        metrics.set_gauge('queued_files', len(video_files), type='video')
+        metrics.set_gauge('active_workers', 0)
         
-        # Process images with a progress bar
-        if image_files:
-            list(tqdm(executor.map(image_task, image_files), total=len(image_files), desc="Converting Images"))
-        
-        # Process videos with a progress bar
-        if video_files:
-            list(tqdm(executor.map(video_task, video_files), total=len(video_files), desc="Converting Videos"))
+        try:
+            # Process images with a progress bar
+            if image_files:
+                list(tqdm(executor.map(image_task, image_files), total=len(image_files), desc="Converting Images"))
+
+            # Process videos with a progress bar
+            if video_files:
+                list(tqdm(executor.map(video_task, video_files), total=len(video_files), desc="Converting Videos"))
+        finally:
+            if stager:
+                executor.shutdown(wait=True, cancel_futures=True)
+                mover.close()
+                stager.close()
 
     logging.info("All tasks completed.")
\ No newline at end of file
@@ -0,0 +1,177 @@
+import os
+import shutil
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from config import STAGING_CHUNK_SIZE
+import metrics
+
+
+def _copy_sequential(source: Path, target: Path):
+    """Copies a file with large sequential reads and preserves its timestamps."""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with open(source, 'rb') as fsrc, open(target, 'wb') as fdst:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fsrc.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        shutil.copyfileobj(fsrc, fdst, STAGING_CHUNK_SIZE)
+    # mtime is the last-resort creation date in metadata_handler, so keep it
+    shutil.copystat(source, target)
+
+
+class SourceStager:
+    """
+    Prefetches queued source files into a local scratch directory.
+
+    A background thread copies files in queue order, keeping at most `lookahead`
+    staged files waiting and at most `budget_bytes` on disk. Workers call acquire()
+    to get the local copy and release() once they are done with it.
+    """
+
+    def __init__(self, files: list[Path], source_dir: Path, scratch_dir: Path, budget_bytes: int, lookahead: int):
+        if lookahead < 1:
+            # With nothing allowed to wait, the prefetch thread and every acquire() would block forever
+            raise ValueError(f"lookahead must be at least 1, got {lookahead}")
+        if budget_bytes < 0:
+            raise ValueError(f"budget_bytes must not be negative, got {budget_bytes}")
+        self.files = files
+        self.source_dir = source_dir
+        self.input_dir = scratch_dir / 'in'
+        self.budget_bytes = budget_bytes
+        self.lookahead = lookahead
+        self._planned = set(files)
+        self._staged = {}  # source path -> local path, or None if it could not be staged
+        self._sizes = {}
+        self._used_bytes = 0
+        self._waiting = 0  # staged but not yet acquired
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _mark_unstaged(self, filepath: Path):
+        with self._cond:
+            self._staged[filepath] = None
+            self._cond.notify_all()
+
+    def _run(self):
+        for filepath in self.files:
+            try:
+                size = filepath.stat().st_size
+            except OSError as e:
+                logging.warning(f"Could not stat {filepath} for staging: {e}")
+                self._mark_unstaged(filepath)
+                continue
+            if size > self.budget_bytes:
+                logging.debug(f"{filepath.name} is larger than the staging budget, reading it in place.")
+                self._mark_unstaged(filepath)
+                continue
+
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or (
+                    self._waiting < self.lookahead and self._used_bytes + size <= self.budget_bytes))
+                if self._closed:
+                    return
+                self._used_bytes += size
+
+            local_path = self.input_dir / filepath.relative_to(self.source_dir)
+            try:
+                _copy_sequential(filepath, local_path)
+            except OSError as e:
+                logging.warning(f"Failed to stage {filepath}, reading it in place: {e}")
+                local_path.unlink(missing_ok=True)
+                with self._cond:
+                    self._used_bytes -= size
+                self._mark_unstaged(filepath)
+                continue
+
+            with self._cond:
+                self._staged[filepath] = local_path
+                self._sizes[filepath] = size
+                self._waiting += 1
+                metrics.set_gauge('staged_bytes', self._used_bytes)
+                self._cond.notify_all()
+
+    def acquire(self, filepath: Path) -> Path | None:
+        """Blocks until the file is staged and returns its local path, or None to read it in place."""
+        if filepath not in self._planned:
+            return None
+        with self._cond:
+            self._cond.wait_for(lambda: self._closed or filepath in self._staged)
+            local_path = self._staged.get(filepath)
+            if local_path is not None:
+                self._waiting -= 1
+                self._cond.notify_all()
+            return local_path
+
+    def release(self, filepath: Path):
+        """Deletes the local copy of a file and frees its share of the budget."""
+        with self._cond:
+            local_path = self._staged.pop(filepath, None)
+            if local_path is None:
+                return
+            local_path.unlink(missing_ok=True)
+            self._used_bytes -= self._sizes.pop(filepath)
+            metrics.set_gauge('staged_bytes', self._used_bytes)
+            self._cond.notify_all()
+
+    def close(self):
+        """Stops prefetching and removes any staged files that were never used."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        shutil.rmtree(self.input_dir, ignore_errors=True)
+
+
+class OutputMover:
+    """
+    Moves finished outputs from local scratch to the target directory in the background.
+    Each run writes into its own fresh directory under scratch, so files left behind by
+    an interrupted run can never be mistaken for finished outputs.
+    """
+
+    def __init__(self, scratch_dir: Path):
+        scratch_dir.mkdir(parents=True, exist_ok=True)
+        self.output_dir = Path(tempfile.mkdtemp(prefix='out-', dir=scratch_dir))
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._lock = threading.Lock()
+        self._stranded = []  # local outputs that could not be moved to the target
+
+    def submit(self, outputs: list[tuple[Path, Path]], source: Path, media_type: str, delete_original: bool = False):
+        """Queues (local, target) moves. The source is deleted only after all of them succeed."""
+        self._executor.submit(self._move, outputs, source, media_type, delete_original)
+
+    def _move(self, outputs: list[tuple[Path, Path]], source: Path, media_type: str, delete_original: bool):
+        for local_path, target_path in outputs:
+            try:
+                target_path.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(str(local_path), str(target_path))
+            except OSError as e:
+                logging.error(f"Failed to move {local_path} to {target_path}: {e}")
+                with self._lock:
+                    self._stranded.extend(p for p, _ in outputs if p.exists())
+                metrics.record_failed(media_type, source, f"could not move output to {target_path}: {e}")
+                return
+
+        if delete_original:
+            try:
+                source.unlink()
+            except OSError as e:
+                logging.error(f"Failed to delete original {source}: {e}")
+
+    def close(self):
+        """
+        Waits for all queued moves to finish, then removes the output directory,
+        unless some outputs could not be moved; those are reported and kept.
+        """
+        self._executor.shutdown(wait=True)
+        if self._stranded:
+            logging.error(f"{len(self._stranded)} output(s) could not be moved to the target directory and were left in scratch:")
+            for local_path in self._stranded:
+                logging.error(f"  {local_path}")
+            return
+        shutil.rmtree(self.output_dir, ignore_errors=True)
@@ -0,0 +1,109 @@
+"""
+Quality guardrail for JPEG shrink-on-load in process_image: the ImageMagick command
+built by build_magick_command must decode oversized JPEGs at a reduced DCT scale, and
+the result must stay close to a full decode plus the same resize. The loss it adds must
+be smaller than what a lossy encode at the default quality costs anyway.
+"""
+import io
+import math
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from image_processor import build_magick_command, get_resize_target
+
+SOURCE_SIZE = (4033, 3025)  # odd sizes that do not divide by the DCT scale factors
+MAX_RES = 1200 * 900
+DEFAULT_QUALITY = 75  # main.py --quality default
+MIN_PSNR_DB = 30.0
+
+
+def _decode_hint(cmd: list[str]) -> str | None:
+    """Returns the jpeg:size value in a magick command, checking it precedes the input."""
+    for i, arg in enumerate(cmd):
+        if arg.startswith('jpeg:size='):
+            assert cmd[i - 1] == '-define'
+            return arg[len('jpeg:size='):]
+    return None
+
+
+def test_oversized_jpeg_gets_decode_hint_for_resize_target():
+    resize_target = get_resize_target(*SOURCE_SIZE, MAX_RES)
+    cmd = build_magick_command(Path('photo.JPG'), Path('photo.avif'), resize_target, 75, 4)
+
+    assert _decode_hint(cmd) == f'{resize_target[0]}x{resize_target[1]}'
+    # The hint only applies if it is set before the input is read
+    assert cmd.index('-define') < cmd.index('photo.JPG')
+    assert cmd[cmd.index('-resize') + 1] == f'{resize_target[0]}x{resize_target[1]}'
+
+
+def test_no_decode_hint_without_resize_or_for_other_formats():
+    assert get_resize_target(1200, 900, MAX_RES) is None
+    assert _decode_hint(build_magick_command(Path('small.jpg'), Path('small.avif'), None, 75, 4)) is None
+
+    resize_target = get_resize_target(*SOURCE_SIZE, MAX_RES)
+    assert _decode_hint(build_magick_command(Path('scan.png'), Path('scan.avif'), resize_target, 75, 4)) is None
+
+
+@pytest.fixture(scope='module')
+def oversized_jpeg(tmp_path_factory):
+    """A synthetic photo-like JPEG with gradients, edges and fine lines."""
+    Image = pytest.importorskip('PIL.Image')
+    from PIL import ImageDraw
+
+    width, height = SOURCE_SIZE
+    gradient = Image.linear_gradient('L').resize(SOURCE_SIZE)
+    image = Image.merge('RGB', (gradient, gradient.rotate(90).resize(SOURCE_SIZE),
+                                Image.radial_gradient('L').resize(SOURCE_SIZE)))
+    draw = ImageDraw.Draw(image)
+    for i in range(0, width, 97):
+        draw.line([(i, 0), (width - i, height)], fill=(255, 255, 255), width=3)
+    for i in range(40):
+        x, y = (i * 331) % width, (i * 577) % height
+        draw.ellipse([x, y, x + 180, y + 120], fill=((i * 53) % 256, (i * 97) % 256, (i * 151) % 256))
+    path = tmp_path_factory.mktemp('shrink') / 'oversized.jpg'
+    image.save(path, quality=92)
+    return path
+
+
+def _psnr(a, b) -> float:
+    from PIL import ImageChops, ImageStat
+
+    stat = ImageStat.Stat(ImageChops.difference(a.convert('RGB'), b.convert('RGB')))
+    mse = sum(stat.sum2) / (len(stat.sum2) * a.width * a.height)
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def _encode_loss_psnr(reference) -> float:
+    """PSNR of a lossy re-encode of the reference at the default quality."""
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    reference.convert('RGB').save(buffer, 'JPEG', quality=DEFAULT_QUALITY)
+    buffer.seek(0)
+    with Image.open(buffer) as encoded:
+        return _psnr(reference, encoded)
+
+
+@pytest.mark.skipif(shutil.which('magick') is None, reason="ImageMagick is not installed")
+def test_shrink_on_load_matches_full_decode(oversized_jpeg, tmp_path):
+    from PIL import Image
+
+    resize_target = get_resize_target(*SOURCE_SIZE, MAX_RES)
+    # Lossless PNG output, so only the decode path differs between the two runs
+    shrunk_cmd = build_magick_command(oversized_jpeg, tmp_path / 'shrunk.png', resize_target, DEFAULT_QUALITY, 4)
+    hint = shrunk_cmd.index('-define')
+    assert shrunk_cmd[hint + 1].startswith('jpeg:size=')
+    full_cmd = shrunk_cmd[:hint] + shrunk_cmd[hint + 2:]
+    full_cmd[-1] = str(tmp_path / 'full.png')
+
+    subprocess.run(shrunk_cmd, check=True)
+    subprocess.run(full_cmd, check=True)
+
+    with Image.open(tmp_path / 'full.png') as reference, Image.open(tmp_path / 'shrunk.png') as result:
+        assert result.size == reference.size == resize_target
+        psnr = _psnr(reference, result)
+        assert psnr >= MIN_PSNR_DB
+        assert psnr > _encode_loss_psnr(reference)
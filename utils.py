@@ -15,9 +15,10 @@ def setup_logging(log_file='conversion.log'):
         ]
     )
 
-def check_dependencies():
+def check_dependencies(dependencies: list[str] = None):
     """Checks if required command-line tools are installed."""
-    dependencies = ['ffmpeg', 'ffprobe', 'exiftool', 'magick']
+    if dependencies is None:
+        dependencies = ['ffmpeg', 'ffprobe', 'exiftool', 'magick']
     missing = []
     for dep in dependencies:
         if not shutil.which(dep):
@@ -49,6 +50,14 @@ def run_command(cmd: list[str], verbose: bool = True):
         return None
     
     
+def format_bytes(num_bytes: float) -> str:
+    """Formats a byte count as a human-readable string, e.g. '1.5 GiB'."""
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if abs(num_bytes) < 1024 or unit == 'TiB':
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+
 # If the source file is a .MOV and there is a .HEIC file in the same directory, it is considered a video attached to a live photo, and CRF + 10
 def is_live_photo_mov(file: Path) -> bool:
     return file.suffix.lower() == '.mov' and (file.with_suffix('.heic')).exists()
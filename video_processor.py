@@ -1,14 +1,16 @@
 import logging
 import json
 import re
+import time
 from math import sqrt, floor
 from pathlib import Path
 from utils import run_command, is_live_photo_mov
 from metadata_handler import copy_metadata
 from config import LIVE_PHOTO_CRF_OFFSET
+import metrics
 
 
-def _get_video_info(filepath: Path) -> dict:
+def get_video_info(filepath: Path) -> dict:
     """Gets video duration, width, height, rotation, and framerate using ffprobe."""
     cmd = ['ffprobe', '-v', 'quiet', '-print_format', 'json',
            '-show_format', '-show_streams', str(filepath)]
@@ -54,25 +56,140 @@ def _get_video_info(filepath: Path) -> dict:
         return {}
 
 
-def process_video(filepath: Path, source_dir: Path, target_dir: Path, ffmpeg_args: str, max_res: int, delete_original: bool, speed_preset: int, max_framerate: int):
-    """Converts a single video file, correctly handling rotation."""
-    relative_path = filepath.relative_to(source_dir)
-    target_path = (target_dir / relative_path).with_suffix('.mp4')
+def get_video_target_path(filepath: Path, source_dir: Path, target_dir: Path) -> Path:
+    """Returns the MP4 output path for a video."""
+    return (target_dir / filepath.relative_to(source_dir)).with_suffix('.mp4')
 
-    if target_path.exists() and target_path.stat().st_size > 0:
+
+def is_video_converted(filepath: Path, source_dir: Path, target_dir: Path) -> bool:
+    """Checks whether a non-empty MP4 output already exists for a video."""
+    target_path = get_video_target_path(filepath, source_dir, target_dir)
+    return target_path.exists() and target_path.stat().st_size > 0
+
+
+def build_video_filters(filepath: Path, width: int, height: int, source_framerate: float, max_res: int, max_framerate: int) -> list[str]:
+    """Builds the scale and fps filters that enforce the resolution and frame rate caps."""
+    video_filters = []
+
+    # --- 分辨率缩放逻辑 ---
+    resolution = width * height
+    if max_res and resolution > max_res:
+        scale_factor = sqrt(max_res / resolution)
+        target_width = floor(width * scale_factor / 2) * 2
+        target_height = floor(height * scale_factor / 2) * 2
+        video_filters.append(f'scale={target_width}:{target_height}')
+        
+    # --- 帧率限制逻辑 ---
+    if max_framerate > 0 and source_framerate > (max_framerate + 3):
+        logging.debug(f"限制帧率：{filepath.name} 从 {source_framerate:.2f}fps 限制到 {max_framerate}fps")
+        video_filters.append(f'fps=fps={max_framerate}')
+
+    return video_filters
+
+
+def _build_encoder_args(ffmpeg_args: str, speed_preset: int) -> list[str]:
+    """Strips rotation metadata from the user's ffmpeg arguments and applies the speed preset."""
+    # 如果ffmpeg参数中包含 -metadata:s:v rotate，则将其移除，因为转换后不再需要
+    ffmpeg_args_list = ffmpeg_args.split()
+    try:
+        rotate_index = ffmpeg_args_list.index('-metadata:s:v')
+        # 移除 -metadata:s:v 和它的值
+        ffmpeg_args_list.pop(rotate_index)
+        ffmpeg_args_list.pop(rotate_index)
+    except ValueError:
+        pass  # 如果参数不存在，则什么也不做
+
+    ffmpeg_args_updated = re.sub(
+        r'-preset \d+', f'-preset {speed_preset}', " ".join(ffmpeg_args_list))
+    return ffmpeg_args_updated.split()
+
+
+# Options from --video-args that configure the video encoder itself. Anything else
+# (audio, container or muxer flags like -movflags or -tag:v) is meant for MP4 and
+# would make the AVIF muxer fail, so it is not passed to convert_animated_image.
+ANIMATION_ENCODER_OPTIONS = (
+    '-c:v', '-codec:v', '-vcodec', '-preset', '-crf', '-qp', '-pix_fmt', '-profile:v', '-tune',
+    '-b:v', '-maxrate', '-bufsize', '-g', '-keyint_min', '-svtav1-params', '-aom-params',
+    '-cpu-used', '-row-mt', '-tiles', '-threads',
+)
+
+
+def _animation_encoder_args(encoder_args: list[str]) -> list[str]:
+    """Keeps only video encoder options (and their values) from a list of ffmpeg arguments."""
+    kept, dropped = [], []
+    i = 0
+    while i < len(encoder_args):
+        option = encoder_args[i]
+        if option in ANIMATION_ENCODER_OPTIONS and i + 1 < len(encoder_args):
+            kept += encoder_args[i:i + 2]
+            i += 2
+        else:
+            dropped.append(option)
+            i += 1
+    if dropped:
+        logging.debug(f"Ignoring non-encoder ffmpeg arguments for animated AVIF: {' '.join(dropped)}")
+    return kept
+
+
+def convert_animated_image(filepath: Path, target_path: Path, ffmpeg_args: str, max_res: int, max_framerate: int, speed_preset: int) -> bool:
+    """
+    Encodes a multi-frame image (e.g. an animated GIF) to animated AVIF with ffmpeg.
+    Uses the same resolution and frame rate caps as process_video, and only the
+    video encoder options from ffmpeg_args (see ANIMATION_ENCODER_OPTIONS).
+    """
+    source_info = get_video_info(filepath)
+    if not source_info:
+        return False
+
+    width, height = source_info['width'], source_info['height']
+    video_filters = build_video_filters(filepath, width, height, source_info.get('framerate', 0), max_res, max_framerate)
+    if not any(f.startswith('scale=') for f in video_filters) and (width % 2 or height % 2):
+        # 4:2:0 chroma subsampling needs even dimensions
+        video_filters.insert(0, f'scale={width // 2 * 2}:{height // 2 * 2}')
+    filter_args = ['-vf', ','.join(video_filters)] if video_filters else []
+
+    cmd = [
+        'ffmpeg', '-y', '-i', str(filepath),
+        *_animation_encoder_args(_build_encoder_args(ffmpeg_args, speed_preset)),
+        '-an',
+        *filter_args,
+        '-f', 'avif',
+        str(target_path)
+    ]
+    if run_command(cmd):
+        return True
+    if target_path.exists(): # Clean up failed attempt
+        target_path.unlink()
+    return False
+
+
+def process_video(filepath: Path, source_dir: Path, target_dir: Path, ffmpeg_args: str, max_res: int, delete_original: bool, speed_preset: int, max_framerate: int, live_photo: bool = None) -> bool:
+    """
+    Converts a single video file, correctly handling rotation.
+    live_photo overrides Live Photo detection, e.g. when filepath is a staged copy without its HEIC.
+    Returns True only if a new output was written.
+    """
+    target_path = get_video_target_path(filepath, source_dir, target_dir)
+
+    if is_video_converted(filepath, source_dir, target_dir):
         logging.info(f"Skipping already converted file: {filepath.name}")
-        return
+        metrics.record_skipped('video')
+        return False
 
     target_path.parent.mkdir(parents=True, exist_ok=True)
 
-    source_info = _get_video_info(filepath)
+    source_info = get_video_info(filepath)
     if not source_info:
         logging.error(f"Could not read video metadata for {filepath}")
-        return
+        metrics.record_failed('video', filepath, 'could not read video metadata')
+        return False
+    source_bytes = filepath.stat().st_size
 
     # region New Logic for Live Photos
 
-    if is_live_photo_mov(filepath):
+    if live_photo is None:
+        live_photo = is_live_photo_mov(filepath)
+    if live_photo:
         logging.debug(
                 f"Live Photo's MOV file detected: {filepath.name}. Adjusting CRF.")
         crf_match = re.search(r'-crf (\d+)', ffmpeg_args)
@@ -87,8 +204,6 @@ def process_video(filepath: Path, source_dir: Path, target_dir: Path, ffmpeg_arg
                 f"'-crf' setting not found in ffmpeg_args for Live Photo: {filepath.name}. Cannot adjust CRF.")
     # endregion
 
-    video_filters = []
-
     # 根据旋转元数据调整宽高
     width = source_info['width']
     height = source_info['height']
@@ -98,59 +213,41 @@ def process_video(filepath: Path, source_dir: Path, target_dir: Path, ffmpeg_arg
     if abs(rotation) in [90, 270]:
         width, height = height, width
 
-    # --- 分辨率缩放逻辑 ---
-    resolution = width * height
-    if max_res and resolution > max_res:
-        scale_factor = sqrt(max_res / resolution)
-        target_width = floor(width * scale_factor / 2) * 2
-        target_height = floor(height * scale_factor / 2) * 2
-        video_filters.append(f'scale={target_width}:{target_height}')
-        
-    # --- 帧率限制逻辑 ---
-    source_framerate = source_info.get('framerate', 0)
-    if max_framerate > 0 and source_framerate > (max_framerate + 3):
-        logging.debug(f"限制帧率：{filepath.name} 从 {source_framerate:.2f}fps 限制到 {max_framerate}fps")
-        video_filters.append(f'fps=fps={max_framerate}')
-        
     filter_args = []
+    video_filters = build_video_filters(filepath, width, height, source_info.get('framerate', 0), max_res, max_framerate)
     if video_filters:
         filter_args = ['-vf', ','.join(video_filters)]
 
-    # 如果ffmpeg参数中包含 -metadata:s:v rotate，则将其移除，因为转换后不再需要
-    ffmpeg_args_list = ffmpeg_args.split()
-    try:
-        rotate_index = ffmpeg_args_list.index('-metadata:s:v')
-        # 移除 -metadata:s:v 和它的值
-        ffmpeg_args_list.pop(rotate_index)
-        ffmpeg_args_list.pop(rotate_index)
-    except ValueError:
-        pass  # 如果参数不存在，则什么也不做
-
     # 添加 -no-autorotate 确保ffmpeg不会自动旋转视频，因为我们已经处理了尺寸
-    ffmpeg_args_updated = re.sub(
-        r'-preset \d+', f'-preset {speed_preset}', " ".join(ffmpeg_args_list))
-
     cmd = [
         'ffmpeg', '-y', '-noautorotate', '-i', str(filepath),
-        *ffmpeg_args_updated.split(),
+        *_build_encoder_args(ffmpeg_args, speed_preset),
         *filter_args,
         str(target_path)
     ]
 
+    encode_start = time.monotonic()
     if run_command(cmd):
-        target_info = _get_video_info(target_path)
+        encode_seconds = time.monotonic() - encode_start
+        target_info = get_video_info(target_path)
         # Verify duration to catch partial conversions
         duration_diff = abs(source_info['duration'] - target_info.get('duration', 0))
         if source_info['duration'] > 0 and duration_diff > 2:
             logging.error(f"Duration mismatch for {target_path.name}. Deleting corrupt file.")
             target_path.unlink()
-            return
-            
+            metrics.record_failed('video', filepath, 'duration mismatch')
+            return False
+
+        metrics.record_video_encode(target_info.get('duration', 0) * target_info.get('framerate', 0), encode_seconds)
         logging.debug(f"Successfully converted {filepath.name} to MP4")
         copy_metadata(filepath, target_path)
+        metrics.record_converted('video', source_bytes, target_path)
         if delete_original:
             filepath.unlink()
+        return True
     else:
         logging.error(f"Failed to convert {filepath.name}")
+        metrics.record_failed('video', filepath, 'ffmpeg encode failed')
         if target_path.exists(): # Clean up failed attempt
-            target_path.unlink()
\ No newline at end of file
+            target_path.unlink()
+        return False
\ No newline at end of file